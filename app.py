@@ -3,15 +3,46 @@ Voice Sampler - Streamlit UI
 A web interface for generating audio using ElevenLabs.
 """
 
+import asyncio
 import os
+import shutil
+import time
 from pathlib import Path
+from typing import Iterable
 
 import streamlit as st
 from dotenv import load_dotenv
-from elevenlabs import ElevenLabs, VoiceSettings
+from elevenlabs import ElevenLabs
+
+from voice_api import (
+    CACHE_DIR,
+    MAX_VARIANTS,
+    create_http_client,
+    generate_variants,
+    get_cache_path,
+    is_cache_fresh,
+    new_seed_base,
+    stream_tts,
+    sweep_cache,
+)
+
+_HERE = Path(__file__).resolve().parent
+_RECORDINGS = _HERE / "recordings"
+
+
+@st.cache_resource(show_spinner=False)
+def init_environment() -> None:
+    """Load .env and create the recordings folder.
+    
+    Streamlit re-executes this script on every rerun, so this is cached
+    to run once per server process.
+    """
+    load_dotenv(_HERE / ".env")
+    _RECORDINGS.mkdir(exist_ok=True)
+
 
 # Load environment variables
-load_dotenv(Path(__file__).parent / ".env")
+init_environment()
 
 # Page config
 st.set_page_config(
@@ -37,156 +68,316 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 
-@st.cache_resource
-def get_client():
-    """Initialize ElevenLabs client."""
+def get_api_key() -> str:
+    """Get ElevenLabs API key from environment."""
     api_key = os.getenv("ELEVENLABS_API_KEY")
     if not api_key:
         st.error("❌ ELEVENLABS_API_KEY not found in .env file")
         st.stop()
-    return ElevenLabs(api_key=api_key)
+    return api_key
+
+
+@st.cache_resource
+def get_http_client():
+    """Initialize the HTTP client shared by all API calls.
+    
+    The connection is kept alive, so the voice listing that runs on
+    startup warms up DNS and TLS for the first generation.
+    """
+    return create_http_client()
+
+
+@st.cache_resource
+def get_client():
+    """Initialize ElevenLabs client."""
+    return ElevenLabs(api_key=get_api_key(), httpx_client=get_http_client())
 
 
 @st.cache_data(ttl=300)
 def get_voices(_client):
-    """Fetch available voices (cached for 5 minutes)."""
+    """Fetch available voices (cached for 5 minutes).
+    
+    Returns the (voice_id, name, category) tuples along with the
+    selectbox labels and a label -> voice ID mapping, so they are built
+    once per fetch rather than on every rerun.
+    """
     response = _client.voices.get_all()
-    return [(v.voice_id, v.name, getattr(v, 'category', 'unknown')) for v in response.voices]
+    voices = tuple(
+        (v.voice_id, v.name, getattr(v, 'category', 'unknown')) for v in response.voices
+    )
+    labels = tuple(f"{name} ({category})" for _, name, category in voices)
+    label_to_id = {label: vid for label, (vid, _, _) in zip(labels, voices)}
+    return voices, labels, label_to_id
 
 
-def generate_audio(client, text: str, voice_id: str, settings: dict) -> bytes:
-    """Generate audio from text."""
-    voice_settings = VoiceSettings(
-        stability=settings["stability"],
-        similarity_boost=settings["similarity"],
-        style=settings["style"],
-        use_speaker_boost=True,
-        speed=settings["speed"],
-    )
+def touch_cache(path: Path) -> str:
+    """Restart a cache file's TTL so it outlives the handle returned for it."""
+    os.utime(path)
+    return str(path)
+
+
+def voice_settings_payload(settings: dict) -> dict:
+    """Map the sidebar values to the API's voice_settings fields."""
+    return {
+        "stability": settings["stability"],
+        "similarity_boost": settings["similarity"],
+        "style": settings["style"],
+        "use_speaker_boost": True,
+        "speed": settings["speed"],
+    }
+
+
+def write_stream(audio_iter: Iterable[bytes], path: Path) -> Path:
+    """Write audio chunks to path as they arrive."""
+    with open(path, "wb", buffering=64 * 1024) as f:
+        for chunk in audio_iter:
+            f.write(chunk)
+    return path
+
+
+def synthesize_to(path: Path, text: str, voice_id: str, settings: dict) -> None:
+    """Stream a synthesis into path.
     
-    audio_generator = client.text_to_speech.convert(
-        voice_id=voice_id,
-        text=text,
-        model_id="eleven_multilingual_v2",
-        voice_settings=voice_settings,
-    )
+    Chunks go to disk as they arrive. They are written to a partial file
+    first so a failed stream never looks complete.
+    """
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    partial_path = path.with_suffix(".part")
+    try:
+        audio_stream = stream_tts(
+            get_http_client(), get_api_key(), text, voice_id, voice_settings_payload(settings)
+        )
+        write_stream(audio_stream, partial_path)
+    except Exception:
+        partial_path.unlink(missing_ok=True)
+        raise
+    partial_path.replace(path)
+
+
+@st.cache_data(ttl="1h", max_entries=200, show_spinner=False)
+def generate_audio(text: str, voice_id: str, settings: dict) -> str:
+    """Generate audio, reusing cached results for identical requests.
+    
+    Returns the path of the cache file holding the MP3. Rendering from a
+    stable path lets Streamlit reuse the same media URL across reruns
+    instead of pushing the bytes again.
+    """
+    cache_path = get_cache_path(text=text, voice_id=voice_id, settings=settings)
+    if is_cache_fresh(cache_path):
+        return touch_cache(cache_path)
     
-    return b"".join(audio_generator)
+    sweep_cache()
+    synthesize_to(cache_path, text, voice_id, settings)
+    return str(cache_path)
 
 
-def save_recording(audio_data: bytes, filename: str) -> Path:
-    """Save audio to recordings folder."""
-    recordings_dir = Path(__file__).parent / "recordings"
-    recordings_dir.mkdir(exist_ok=True)
-    save_path = recordings_dir / f"{filename}.mp3"
-    save_path.write_bytes(audio_data)
-    return save_path
+def regenerate_audio(text: str, voice_id: str, settings: dict) -> str:
+    """Generate a fresh variation, bypassing the audio cache.
+    
+    The result is neither read from nor stored under the request's cache
+    key, so Generate keeps serving the shared entry. The file is kept in
+    CACHE_DIR only so the TTL sweep removes it.
+    """
+    sweep_cache()
+    path = CACHE_DIR / f"take_{time.time_ns()}.mp3"
+    synthesize_to(path, text, voice_id, settings)
+    return str(path)
 
 
-# Main UI
-st.title("🎙️ Voice Sampler")
-st.caption("Generate and test voice audio using ElevenLabs")
+def generate_variant_files(text: str, voice_id: str, settings: dict, count: int) -> list:
+    """Generate several variations of a phrase concurrently.
+    
+    Seeds start from a random base, so every click yields a new set.
+    Variants are written through the audio cache, keyed by seed, and
+    the cache file paths are returned in order.
+    """
+    sweep_cache()
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    
+    seed_base = new_seed_base(count)
+    seeded_paths = [
+        (seed, get_cache_path(text=text, voice_id=voice_id, settings=settings, seed=seed))
+        for seed in range(seed_base, seed_base + count)
+    ]
+    # Streamlit runs the script outside any event loop, so asyncio.run
+    # can create and close its own
+    asyncio.run(
+        generate_variants(
+            get_api_key(), text, voice_id, voice_settings_payload(settings), seeded_paths
+        )
+    )
+    return [str(path) for _, path in seeded_paths]
 
-# Initialize client
-client = get_client()
-voices = get_voices(client)
 
-# Create voice options
-voice_options = {f"{name} ({category})": vid for vid, name, category in voices}
+def save_recording(audio_path: str, filename: str) -> Path:
+    """Save an audio file to recordings folder."""
+    # Recreate the folder in case it was removed while the server runs
+    _RECORDINGS.mkdir(parents=True, exist_ok=True)
+    save_path = _RECORDINGS / f"{filename}.mp3"
+    with open(audio_path, "rb") as src, open(save_path, "wb") as dst:
+        shutil.copyfileobj(src, dst, 64 * 1024)
+    return save_path
 
-# Sidebar for settings
-with st.sidebar:
-    st.header("⚙️ Voice Settings")
+
+@st.fragment
+def settings_panel():
+    """Voice settings sliders.
     
-    stability = st.slider(
-        "Stability",
-        min_value=0.0,
-        max_value=1.0,
-        value=0.5,
-        step=0.05,
-        help="Lower = more expressive, Higher = more consistent"
-    )
+    The sliders live in a form so dragging them doesn't trigger a rerun,
+    and applying them only reruns this fragment. Values are read from
+    st.session_state when generating.
+    """
+    with st.form("voice_settings", border=False):
+        st.slider(
+            "Stability",
+            min_value=0.0,
+            max_value=1.0,
+            value=0.5,
+            step=0.05,
+            help="Lower = more expressive, Higher = more consistent",
+            key="stability",
+        )
+        
+        st.slider(
+            "Similarity",
+            min_value=0.0,
+            max_value=1.0,
+            value=0.75,
+            step=0.05,
+            help="How closely it matches the original voice",
+            key="similarity",
+        )
+        
+        st.slider(
+            "Style",
+            min_value=0.0,
+            max_value=1.0,
+            value=0.0,
+            step=0.05,
+            help="Style exaggeration (0 = neutral)",
+            key="style",
+        )
+        
+        st.slider(
+            "Speed",
+            min_value=0.7,
+            max_value=1.2,
+            value=1.0,
+            step=0.05,
+            help="Speaking speed (0.7 = slow, 1.0 = normal, 1.2 = fast)",
+            key="speed",
+        )
+        
+        st.form_submit_button("Apply Settings", use_container_width=True)
+
+
+@st.fragment
+def generate_panel(voice_options: dict):
+    """Generate buttons, variants and the resulting audio.
     
-    similarity = st.slider(
-        "Similarity",
-        min_value=0.0,
-        max_value=1.0,
-        value=0.75,
-        step=0.05,
-        help="How closely it matches the original voice"
-    )
+    Button clicks only rerun this fragment, so voices aren't re-listed
+    and the selectbox isn't rebuilt on every generation.
+    """
+    phrase = st.session_state.phrase.strip()
+    voice_id = voice_options[st.session_state.voice_label]
+    settings = {
+        "stability": st.session_state.stability,
+        "similarity": st.session_state.similarity,
+        "style": st.session_state.style,
+        "speed": st.session_state.speed,
+    }
     
-    style = st.slider(
-        "Style",
-        min_value=0.0,
-        max_value=1.0,
-        value=0.0,
-        step=0.05,
-        help="Style exaggeration (0 = neutral)"
-    )
+    col1, col2 = st.columns(2)
     
-    speed = st.slider(
-        "Speed",
-        min_value=0.7,
-        max_value=1.2,
-        value=1.0,
-        step=0.05,
-        help="Speaking speed (0.7 = slow, 1.0 = normal, 1.2 = fast)"
-    )
+    with col1:
+        generate_btn = st.button("🎙️ Generate", type="primary", use_container_width=True)
     
-    st.divider()
+    with col2:
+        regenerate_btn = st.button("🔄 Regenerate", use_container_width=True)
     
-    if st.button("Refresh Voices", use_container_width=True):
-        get_voices.clear()
-        st.rerun()
-
-# Main content
-selected_voice = st.selectbox(
-    "🎤 Select Voice",
-    options=list(voice_options.keys()),
-    index=0,
-)
+    col1, col2 = st.columns([1, 3])
+    
+    with col1:
+        variant_count = st.number_input(
+            "Variants",
+            min_value=2,
+            max_value=MAX_VARIANTS,
+            value=3,
+            label_visibility="collapsed",
+        )
+    
+    with col2:
+        variants_btn = st.button("🎲 Generate Variants", use_container_width=True)
+    
+    # Generate audio
+    if generate_btn or regenerate_btn:
+        if not phrase:
+            st.warning("Please enter a phrase to generate.")
+        else:
+            # Regenerate skips the cache; Generate always uses the shared entry
+            generate = regenerate_audio if regenerate_btn else generate_audio
+            
+            with st.spinner("Generating audio..."):
+                try:
+                    audio_path = generate(phrase, voice_id, settings)
+                    st.session_state.audio_path = audio_path
+                    st.session_state.last_phrase = phrase
+                except Exception as e:
+                    st.error(f"Error generating audio: {e}")
+    
+    # Generate variants concurrently
+    if variants_btn:
+        if not phrase:
+            st.warning("Please enter a phrase to generate.")
+        else:
+            with st.spinner(f"Generating {variant_count} variants..."):
+                try:
+                    st.session_state.variants = generate_variant_files(
+                        phrase, voice_id, settings, int(variant_count)
+                    )
+                except Exception as e:
+                    st.error(f"Error generating variants: {e}")
+    
+    # Display variants, any of which can become the current audio
+    if st.session_state.get("variants"):
+        st.divider()
+        st.subheader("🎲 Variants")
+        for i, variant in enumerate(st.session_state.variants, 1):
+            if not Path(variant).exists():
+                continue  # Expired from the audio cache
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                st.audio(variant, format="audio/mp3")
+            with col2:
+                if st.button(f"Keep #{i}", key=f"keep_variant_{i}", use_container_width=True):
+                    st.session_state.audio_path = variant
+                    st.session_state.last_phrase = phrase
+    
+    audio_panel()
 
-phrase = st.text_area(
-    "📝 Enter phrase to generate",
-    placeholder="Hello, this is a test of the voice sampler...",
-    height=100,
-)
 
-col1, col2 = st.columns(2)
-
-with col1:
-    generate_btn = st.button("🎙️ Generate", type="primary", use_container_width=True)
-
-with col2:
-    regenerate_btn = st.button("🔄 Regenerate", use_container_width=True)
-
-# Generate audio
-if generate_btn or regenerate_btn:
-    if not phrase.strip():
-        st.warning("Please enter a phrase to generate.")
-    else:
-        voice_id = voice_options[selected_voice]
-        settings = {
-            "stability": stability,
-            "similarity": similarity,
-            "style": style,
-            "speed": speed,
-        }
-        
-        with st.spinner("Generating audio..."):
-            try:
-                audio_data = generate_audio(client, phrase.strip(), voice_id, settings)
-                st.session_state.audio_data = audio_data
-                st.session_state.last_phrase = phrase.strip()
-            except Exception as e:
-                st.error(f"Error generating audio: {e}")
-
-# Display audio player if we have audio
-if "audio_data" in st.session_state:
+@st.fragment
+def audio_panel():
+    """Player, save and download controls for the current audio.
+    
+    Only reads st.session_state.audio_path, so typing a filename or
+    saving reruns just this fragment.
+    """
+    audio_path = st.session_state.get("audio_path")
+    if not audio_path:
+        return
+    
+    # The cache sweep may have removed the file since it was generated;
+    # opening it up front also keeps it readable for the download button
+    try:
+        audio_file = open(audio_path, "rb")
+    except FileNotFoundError:
+        del st.session_state.audio_path
+        return
+    
     st.divider()
     st.subheader("▶️ Generated Audio")
-    st.audio(st.session_state.audio_data, format="audio/mp3")
+    st.audio(audio_path, format="audio/mp3")
     
     # Save section
     col1, col2 = st.columns([3, 1])
@@ -201,16 +392,60 @@ if "audio_data" in st.session_state:
     with col2:
         if st.button("💾 Save", use_container_width=True):
             if save_name.strip():
-                save_path = save_recording(st.session_state.audio_data, save_name.strip())
-                st.success(f"Saved to {save_path}")
+                try:
+                    save_path = save_recording(audio_path, save_name.strip())
+                    st.success(f"Saved to {save_path}")
+                except FileNotFoundError:
+                    st.warning("Audio expired from the cache, generate it again")
             else:
                 st.warning("Enter a filename")
     
     # Download button
-    st.download_button(
-        label="⬇️ Download MP3",
-        data=st.session_state.audio_data,
-        file_name="voice_sample.mp3",
-        mime="audio/mp3",
-        use_container_width=True,
-    )
+    with audio_file:
+        st.download_button(
+            label="⬇️ Download MP3",
+            data=audio_file,
+            file_name="voice_sample.mp3",
+            mime="audio/mp3",
+            use_container_width=True,
+        )
+
+
+# Main UI
+st.title("🎙️ Voice Sampler")
+st.caption("Generate and test voice audio using ElevenLabs")
+
+# Initialize client
+client = get_client()
+_, voice_labels, voice_options = get_voices(client)
+
+# Sidebar for settings
+with st.sidebar:
+    st.header("⚙️ Voice Settings")
+    
+    settings_panel()
+    
+    st.divider()
+    
+    if st.button("Refresh Voices", use_container_width=True):
+        get_voices.clear()
+        generate_audio.clear()
+        sweep_cache()
+        st.rerun()
+
+# Main content
+st.selectbox(
+    "🎤 Select Voice",
+    options=voice_labels,
+    index=0,
+    key="voice_label",
+)
+
+st.text_area(
+    "📝 Enter phrase to generate",
+    placeholder="Hello, this is a test of the voice sampler...",
+    height=100,
+    key="phrase",
+)
+
+generate_panel(voice_options)
@@ -4,17 +4,66 @@ Voice Sampler - Generate audio from text using ElevenLabs
 Allows regeneration until you're happy with the result.
 """
 
+import asyncio
 import os
 import sys
+import shutil
 import tempfile
+import threading
 import subprocess
+import wave
 from pathlib import Path
+from typing import Iterator, Optional
 
+import httpx
 from dotenv import load_dotenv
-from elevenlabs import ElevenLabs, VoiceSettings
+from elevenlabs import ElevenLabs
+
+from voice_api import (
+    CACHE_DIR,
+    MAX_VARIANTS,
+    STREAM_CHUNK_SIZE,
+    create_http_client,
+    generate_variants,
+    get_cache_path,
+    is_cache_fresh,
+    new_seed_base,
+    stream_tts,
+    sweep_cache,
+)
+
+try:
+    import pyaudio
+except ImportError:
+    pyaudio = None
+
+_HERE = Path(__file__).resolve().parent
 
 # Load environment variables from .env file
-load_dotenv(Path(__file__).parent / ".env")
+load_dotenv(_HERE / ".env")
+
+# Starting voice and settings; every settings dict has exactly these keys
+DEFAULT_VOICE = "bIHbv24MWmeRgasZH58o"
+DEFAULT_SETTINGS = {
+    "stability": 0.5,
+    "similarity_boost": 0.75,
+    "style": 0.0,
+    "use_speaker_boost": True,
+}
+
+# With PyAudio installed, request raw PCM and play it as it arrives with no
+# MP3 decode step; it is kept as WAV for replaying and saving. Otherwise
+# fall back to MP3 and a system player.
+PCM_RATE = 22050
+if pyaudio:
+    OUTPUT_FORMAT = f"pcm_{PCM_RATE}"
+    AUDIO_EXT = ".wav"
+else:
+    OUTPUT_FORMAT = "mp3_44100_128"
+    AUDIO_EXT = ".mp3"
+
+# Bytes the wave module writes before the PCM frames
+WAV_HEADER_SIZE = 44
 
 
 def get_api_key() -> str:
@@ -27,18 +76,244 @@ def get_api_key() -> str:
     return api_key
 
 
-def play_audio(file_path: str) -> None:
-    """Play audio file using system player."""
+# Player process for the audio currently playing, if any
+_player: Optional[subprocess.Popen] = None
+
+# PyAudio worker thread for streamed PCM, and the event that stops it
+_pcm_worker: Optional[threading.Thread] = None
+_pcm_stop = threading.Event()
+
+
+def stop_playback() -> None:
+    """Stop any audio that is still playing."""
+    global _player, _pcm_worker
+    if _player and _player.poll() is None:
+        _player.terminate()
+        _player.wait()
+    _player = None
+    if _pcm_worker:
+        _pcm_stop.set()
+        _pcm_worker.join()
+        _pcm_worker = None
+    if sys.platform == "win32":
+        import winsound
+        winsound.PlaySound(None, 0)
+
+
+def play_audio(file_path: str, wait: bool = False) -> None:
+    """Play audio file using system player.
+    
+    Returns as soon as playback starts unless `wait` is set, so the
+    prompt stays usable while audio plays.
+    """
+    global _player
+    stop_playback()
     if sys.platform == "darwin":
-        subprocess.run(["afplay", file_path], check=True)
+        _player = subprocess.Popen(["afplay", file_path])
     elif sys.platform == "linux":
-        subprocess.run(["aplay", file_path], check=True)
+        _player = subprocess.Popen(["aplay", file_path])
     elif sys.platform == "win32":
         import winsound
-        winsound.PlaySound(file_path, winsound.SND_FILENAME)
+        flags = winsound.SND_FILENAME
+        if not wait:
+            flags |= winsound.SND_ASYNC
+        winsound.PlaySound(file_path, flags)
     else:
         print(f"Audio saved to: {file_path}")
         print("Automatic playback not supported on this platform.")
+    
+    if wait and _player:
+        _player.wait()
+
+
+def _stream_player() -> Optional[subprocess.Popen]:
+    """Start a player that reads MP3 from stdin, if one is installed."""
+    if shutil.which("ffplay"):
+        cmd = ["ffplay", "-nodisp", "-autoexit", "-loglevel", "quiet", "-"]
+    elif shutil.which("mpg123"):
+        cmd = ["mpg123", "-q", "-"]
+    else:
+        return None
+    return subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+
+def tee_to_file(audio_stream: Iterator[bytes], file_path: Path) -> Iterator[bytes]:
+    """Yield audio chunks while writing each one to file_path.
+    
+    Lets a player and the file share one stream without holding the
+    whole recording in memory. Each chunk is flushed before it is
+    yielded, so readers following the file see it straight away.
+    """
+    with open(file_path, "wb") as f:
+        for chunk in audio_stream:
+            f.write(chunk)
+            f.flush()
+            yield chunk
+
+
+def follow_file(file_path: Path, done: threading.Event, offset: int = 0) -> Iterator[bytes]:
+    """Yield data appended to file_path until `done` is set and it is all read.
+    
+    Lets a player trail a file that is still being written, so chunks
+    wait on disk instead of piling up in memory when playback is slower
+    than the download.
+    """
+    with open(file_path, "rb") as f:
+        f.seek(offset)
+        while True:
+            finished = done.is_set()
+            chunk = f.read(STREAM_CHUNK_SIZE)
+            if chunk:
+                yield chunk
+            elif finished:
+                return
+            else:
+                done.wait(0.05)
+
+
+def _feed_player(player: subprocess.Popen, file_path: Path, done: threading.Event) -> None:
+    """Copy file_path to the player's stdin as it is written."""
+    try:
+        for chunk in follow_file(file_path, done):
+            player.stdin.write(chunk)
+    except OSError:
+        pass  # Player was stopped or closed early; nothing left to feed
+    finally:
+        try:
+            player.stdin.close()
+        except OSError:
+            pass
+
+
+def play_stream(audio_stream: Iterator[bytes], file_path: Path) -> None:
+    """Play audio chunks as they arrive while writing them to file_path.
+    
+    A writer thread feeds the player from the file, so a full pipe never
+    throttles the download and memory use stays flat: this returns once
+    the stream has been received and the player keeps going in the
+    background. Falls back to play_audio() on the finished file when no
+    player that can read from stdin is available.
+    """
+    global _player
+    stop_playback()
+    player = _stream_player()
+    if not player:
+        for _ in tee_to_file(audio_stream, file_path):
+            pass
+        play_audio(str(file_path))
+        return
+    
+    _player = player
+    done = threading.Event()
+    feeder = None
+    try:
+        for _ in tee_to_file(audio_stream, file_path):
+            # The file exists once the first chunk is written
+            if not feeder:
+                feeder = threading.Thread(
+                    target=_feed_player, args=(player, file_path, done), daemon=True
+                )
+                feeder.start()
+    finally:
+        done.set()
+        if not feeder:
+            player.stdin.close()
+
+
+def _open_pcm_output():
+    """Open a PyAudio output stream for mono 16-bit PCM at PCM_RATE."""
+    audio = pyaudio.PyAudio()
+    try:
+        return audio, audio.open(format=pyaudio.paInt16, channels=1, rate=PCM_RATE, output=True)
+    except OSError:
+        audio.terminate()
+        raise
+
+
+def _play_pcm_file(audio, stream, file_path: Path, done: threading.Event,
+                   failed: threading.Event) -> None:
+    """Play the PCM frames of the WAV at file_path as it is written.
+    
+    Sets `failed` if the device errors out, so the caller can fall back
+    to playing the file.
+    """
+    pending = b""
+    try:
+        for chunk in follow_file(file_path, done, WAV_HEADER_SIZE):
+            if _pcm_stop.is_set():
+                break
+            # Reads can split a 16-bit sample; carry the odd byte
+            pending += chunk
+            usable = len(pending) - len(pending) % 2
+            stream.write(pending[:usable])
+            pending = pending[usable:]
+    except OSError:
+        failed.set()
+    finally:
+        try:
+            stream.stop_stream()
+            stream.close()
+        except OSError:
+            pass
+        audio.terminate()
+
+
+def play_pcm_stream(audio_stream: Iterator[bytes], file_path: Path) -> None:
+    """Play raw PCM chunks through PyAudio as they arrive while writing
+    them to a WAV file at file_path.
+    
+    Playback runs on a worker thread that reads the frames back from the
+    file, so this returns once the stream has been received. If the
+    output device can't be opened or fails mid-stream, the finished WAV
+    is played with play_audio() instead.
+    """
+    global _pcm_worker
+    stop_playback()
+    _pcm_stop.clear()
+    try:
+        audio, stream = _open_pcm_output()
+    except OSError as e:
+        print(f"⚠️  Live playback unavailable ({e}), playing once downloaded")
+        audio = stream = None
+    
+    done = threading.Event()
+    failed = threading.Event()
+    try:
+        with wave.open(str(file_path), "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(PCM_RATE)
+            if audio:
+                _pcm_worker = threading.Thread(
+                    target=_play_pcm_file,
+                    args=(audio, stream, file_path, done, failed),
+                    daemon=True,
+                )
+                _pcm_worker.start()
+            for chunk in audio_stream:
+                # writeframes() seeks to patch the header, which flushes
+                # the frames to disk for the worker
+                wav.writeframes(chunk)
+    finally:
+        done.set()
+    
+    if not audio or failed.is_set():
+        play_audio(str(file_path))
+
+
+def prewarm_connection(client: ElevenLabs) -> None:
+    """Open the API connection in the background.
+    
+    Resolves DNS and completes the TLS handshake while the user is
+    still typing, so the first generation doesn't pay for it.
+    """
+    def warm():
+        try:
+            client.voices.get_all()
+        except Exception:
+            pass  # The first real request reports any problem
+    
+    threading.Thread(target=warm, daemon=True).start()
 
 
 def get_voices(client: ElevenLabs) -> list:
@@ -76,52 +351,201 @@ def select_voice(client: ElevenLabs, current_voice: str) -> str:
     return current_voice
 
 
+def voice_settings_payload(settings: dict) -> dict:
+    """Map a settings dict to the API's voice_settings fields."""
+    return {
+        "stability": settings["stability"],
+        "similarity_boost": settings["similarity_boost"],
+        "style": settings["style"],
+        "use_speaker_boost": settings["use_speaker_boost"],
+    }
+
+
 def generate_audio(
-    client: ElevenLabs,
+    http_client: httpx.Client,
+    api_key: str,
     text: str,
-    voice: str = "bIHbv24MWmeRgasZH58o",
+    voice: str = DEFAULT_VOICE,
     settings: dict = None,
-) -> bytes:
-    """Generate audio from text using ElevenLabs."""
-    settings = settings or {}
+) -> Iterator[bytes]:
+    """Stream audio from text using ElevenLabs."""
+    settings = settings or DEFAULT_SETTINGS
     
     print(f"\n🎙️  Generating audio for: \"{text}\"")
     print(f"   Voice: {voice}")
-    print(f"   Stability: {settings.get('stability', 0.5):.2f}")
-    print(f"   Similarity: {settings.get('similarity_boost', 0.75):.2f}")
-    print(f"   Style: {settings.get('style', 0.0):.2f}")
+    print(f"   Stability: {settings['stability']:.2f}")
+    print(f"   Similarity: {settings['similarity_boost']:.2f}")
+    print(f"   Style: {settings['style']:.2f}")
     
-    voice_settings = VoiceSettings(
-        stability=settings.get("stability", 0.5),
-        similarity_boost=settings.get("similarity_boost", 0.75),
-        style=settings.get("style", 0.0),
-        use_speaker_boost=settings.get("use_speaker_boost", True),
+    return stream_tts(
+        http_client, api_key, text, voice, voice_settings_payload(settings), OUTPUT_FORMAT
     )
-    
-    audio_generator = client.text_to_speech.convert(
-        voice_id=voice,
-        text=text,
-        model_id="eleven_multilingual_v2",
-        voice_settings=voice_settings,
+
+
+def cache_path_for(session: dict) -> Path:
+    """Get the audio cache file for the session's current request."""
+    return get_cache_path(
+        AUDIO_EXT,
+        text=session["phrase"],
+        voice=session["voice"],
+        settings=session["settings"],
+        format=OUTPUT_FORMAT,
     )
-    
-    # Collect all audio chunks
-    audio_data = b"".join(audio_generator)
-    return audio_data
 
 
 def print_settings(settings: dict) -> None:
     """Print current voice settings."""
     print("\n  Current Settings:")
-    print(f"   Stability:  {settings.get('stability', 0.5):.2f}  (0=variable, 1=stable)")
-    print(f"   Similarity: {settings.get('similarity_boost', 0.75):.2f}  (0=diverse, 1=close to original)")
-    print(f"   Style:      {settings.get('style', 0.0):.2f}  (0=neutral, 1=exaggerated)")
+    print(f"   Stability:  {settings['stability']:.2f}  (0=variable, 1=stable)")
+    print(f"   Similarity: {settings['similarity_boost']:.2f}  (0=diverse, 1=close to original)")
+    print(f"   Style:      {settings['style']:.2f}  (0=neutral, 1=exaggerated)")
+
+
+# Each handler below takes the session state dict and returns True when the
+# audio should be generated again, or False to prompt for another choice.
+
+
+def handle_regenerate(session: dict) -> bool:
+    """Regenerate the same phrase as a fresh variation."""
+    print("\n🔄 Regenerating...")
+    # A fresh variation must neither come from nor go to the cache
+    session["fresh"] = True
+    return True
+
+
+def handle_variants(session: dict) -> bool:
+    """Generate several variants, play each, and optionally keep one."""
+    val = input(f"How many variants (max {MAX_VARIANTS})? [3]: ").strip()
+    count = min(int(val), MAX_VARIANTS) if val.isdigit() and int(val) > 0 else 3
+    print(f"\n🎲 Generating {count} variants...")
+    variant_paths = [
+        session["temp_dir"] / f"variant_{i}{AUDIO_EXT}" for i in range(1, count + 1)
+    ]
+    try:
+        asyncio.run(
+            generate_variants(
+                session["api_key"],
+                session["phrase"],
+                session["voice"],
+                voice_settings_payload(session["settings"]),
+                # A random seed base makes every batch a new set
+                list(enumerate(variant_paths, new_seed_base(count))),
+                OUTPUT_FORMAT,
+                PCM_RATE if pyaudio else None,
+            )
+        )
+    except Exception as e:
+        print(f"\n❌ Error generating variants: {e}")
+        return False
+    
+    for i, variant_path in enumerate(variant_paths, 1):
+        print(f"\n▶️  Playing variant #{i}...")
+        play_audio(str(variant_path), wait=True)
+    
+    pick = input(f"\nKeep variant # (1-{count}), or press Enter to keep current: ").strip()
+    if pick.isdigit() and 1 <= int(pick) <= count:
+        shutil.copyfile(variant_paths[int(pick) - 1], session["audio_path"])
+        print(f"✅ Kept variant #{pick}")
+    return False
+
+
+def handle_play(session: dict) -> bool:
+    """Play the current audio again."""
+    print("\n▶️  Playing again...")
+    play_audio(str(session["audio_path"]))
+    return False
+
+
+def handle_save(session: dict) -> bool:
+    """Save the current audio to the recordings folder."""
+    save_name = input("Save as (filename without extension): ").strip()
+    if save_name:
+        recordings_dir = Path.cwd() / "recordings"
+        recordings_dir.mkdir(exist_ok=True)
+        save_path = recordings_dir / f"{save_name}{AUDIO_EXT}"
+        with open(session["audio_path"], "rb") as src:
+            with open(save_path, "wb") as dst:
+                shutil.copyfileobj(src, dst, length=64 * 1024)
+        print(f"✅ Saved to: {save_path}")
+    return False
+
+
+def handle_new_phrase(session: dict) -> bool:
+    """Prompt for a new phrase."""
+    phrase = input("Enter new phrase: ").strip()
+    if not phrase:
+        print("No phrase entered.")
+        return False
+    session["phrase"] = phrase
+    session["generation_count"] = 0
+    session["fresh"] = False
+    return True
+
+
+def handle_change_voice(session: dict) -> bool:
+    """Pick a different voice."""
+    session["voice"] = select_voice(session["client"], session["voice"])
+    session["fresh"] = False
+    print("\n🔄 Regenerating with new voice...")
+    return True
+
+
+def handle_edit_settings(session: dict) -> bool:
+    """Edit the voice settings."""
+    settings = session["settings"]
+    print_settings(settings)
+    print("\nEnter new values (0.0-1.0) or press Enter to keep current:")
+    
+    val = input(f"  Stability [{settings['stability']:.2f}]: ").strip()
+    if val:
+        settings["stability"] = max(0.0, min(1.0, float(val)))
+    
+    val = input(f"  Similarity [{settings['similarity_boost']:.2f}]: ").strip()
+    if val:
+        settings["similarity_boost"] = max(0.0, min(1.0, float(val)))
+    
+    val = input(f"  Style [{settings['style']:.2f}]: ").strip()
+    if val:
+        settings["style"] = max(0.0, min(1.0, float(val)))
+    
+    print_settings(settings)
+    session["fresh"] = False
+    print("\n🔄 Regenerating with new settings...")
+    return True
+
+
+def handle_quit(session: dict) -> bool:
+    """Stop playback and exit."""
+    print("\n👋 Goodbye!")
+    stop_playback()
+    sys.exit(0)
+
+
+def handle_invalid(session: dict) -> bool:
+    """Report an unknown choice."""
+    print("Invalid choice. Please enter r, g, p, s, n, v, e, or q.")
+    return False
+
+
+CHOICE_HANDLERS = {
+    "r": handle_regenerate,
+    "g": handle_variants,
+    "p": handle_play,
+    "s": handle_save,
+    "n": handle_new_phrase,
+    "v": handle_change_voice,
+    "e": handle_edit_settings,
+    "q": handle_quit,
+}
 
 
 def main():
     # Initialize client first for --list-voices
     api_key = get_api_key()
-    client = ElevenLabs(api_key=api_key)
+    http_client = create_http_client()
+    client = ElevenLabs(api_key=api_key, httpx_client=http_client)
+    prewarm_connection(client)
+    sweep_cache()
     
     # Get phrase from command line or prompt
     if len(sys.argv) > 1:
@@ -132,125 +556,77 @@ def main():
             print("No phrase provided. Exiting.")
             sys.exit(1)
     
-    # Create temp directory for audio files
-    temp_dir = tempfile.mkdtemp(prefix="voice_sampler_")
-    audio_path = Path(temp_dir) / "output.mp3"
-    
-    # Current voice
-    current_voice = "bIHbv24MWmeRgasZH58o"
-    
-    # Voice settings (adjustable)
-    settings = {
-        "stability": 0.5,
-        "similarity_boost": 0.75,
-        "style": 0.0,
-        "use_speaker_boost": True,
-    }
-    
-    generation_count = 0
-    
-    while True:
-        generation_count += 1
-        
-        try:
-            # Generate audio
-            audio_data = generate_audio(client, phrase, voice=current_voice, settings=settings)
-            
-            # Save to file
-            with open(audio_path, "wb") as f:
-                f.write(audio_data)
-            
-            print(f"\n▶️  Playing audio (generation #{generation_count})...")
-            play_audio(str(audio_path))
-            
-        except Exception as e:
-            print(f"\n❌ Error generating audio: {e}")
-            retry = input("Try again? [y/n]: ").strip().lower()
-            if retry == "y":
-                continue
-            else:
-                break
-        
-        # Ask user what to do next
-        print("\n" + "─" * 40)
-        print("Options:")
-        print("  [r] Regenerate with same phrase")
-        print("  [p] Play again")
-        print("  [s] Save to file")
-        print("  [n] New phrase")
-        print("  [v] Change voice")
-        print("  [e] Edit voice settings")
-        print("  [q] Quit")
+    # Temp directory for audio files, removed on every exit path
+    with tempfile.TemporaryDirectory(prefix="voice_sampler_") as temp_dir:
+        session = {
+            "client": client,
+            "api_key": api_key,
+            "temp_dir": Path(temp_dir),
+            "audio_path": Path(temp_dir) / f"output{AUDIO_EXT}",
+            "phrase": phrase,
+            "voice": DEFAULT_VOICE,
+            # Voice settings (adjustable)
+            "settings": dict(DEFAULT_SETTINGS),
+            "generation_count": 0,
+            # Set by regenerate so the next generation bypasses the cache
+            "fresh": False,
+        }
+        audio_path = session["audio_path"]
         
         while True:
-            choice = input("\nYour choice: ").strip().lower()
-            
-            if choice == "r":
-                print("\n🔄 Regenerating...")
-                break
+            session["generation_count"] += 1
+            phrase = session["phrase"]
+            voice = session["voice"]
+            settings = session["settings"]
             
-            elif choice == "p":
-                print("\n▶️  Playing again...")
-                play_audio(str(audio_path))
-            
-            elif choice == "s":
-                save_name = input("Save as (filename without extension): ").strip()
-                if save_name:
-                    recordings_dir = Path.cwd() / "recordings"
-                    recordings_dir.mkdir(exist_ok=True)
-                    save_path = recordings_dir / f"{save_name}.mp3"
-                    with open(audio_path, "rb") as src:
-                        with open(save_path, "wb") as dst:
-                            dst.write(src.read())
-                    print(f"✅ Saved to: {save_path}")
-            
-            elif choice == "n":
-                phrase = input("Enter new phrase: ").strip()
-                if phrase:
-                    generation_count = 0
-                    break
-                print("No phrase entered.")
-            
-            elif choice == "v":
-                current_voice = select_voice(client, current_voice)
-                print("\n🔄 Regenerating with new voice...")
-                break
-            
-            elif choice == "e":
-                print_settings(settings)
-                print("\nEnter new values (0.0-1.0) or press Enter to keep current:")
-                
-                val = input(f"  Stability [{settings['stability']:.2f}]: ").strip()
-                if val:
-                    settings["stability"] = max(0.0, min(1.0, float(val)))
+            try:
+                cache_path = None if session["fresh"] else cache_path_for(session)
+                if cache_path and is_cache_fresh(cache_path):
+                    print(f"\n♻️  Using cached audio for: \"{phrase}\"")
+                    stop_playback()
+                    shutil.copyfile(cache_path, audio_path)
+                    print(f"\n▶️  Playing audio (generation #{session['generation_count']})...")
+                    play_audio(str(audio_path))
+                else:
+                    # Generate audio, playing and saving chunks as they arrive
+                    audio_stream = generate_audio(
+                        http_client, api_key, phrase, voice=voice, settings=settings
+                    )
+                    
+                    print(f"\n▶️  Playing audio (generation #{session['generation_count']})...")
+                    if pyaudio:
+                        play_pcm_stream(audio_stream, audio_path)
+                    else:
+                        play_stream(audio_stream, audio_path)
+                    
+                    if cache_path:
+                        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+                        shutil.copyfile(audio_path, cache_path)
                 
-                val = input(f"  Similarity [{settings['similarity_boost']:.2f}]: ").strip()
-                if val:
-                    settings["similarity_boost"] = max(0.0, min(1.0, float(val)))
-                
-                val = input(f"  Style [{settings['style']:.2f}]: ").strip()
-                if val:
-                    settings["style"] = max(0.0, min(1.0, float(val)))
-                
-                print_settings(settings)
-                print("\n🔄 Regenerating with new settings...")
-                break
+            except Exception as e:
+                print(f"\n❌ Error generating audio: {e}")
+                retry = input("Try again? [y/n]: ").strip().lower()
+                if retry == "y":
+                    continue
+                else:
+                    break
             
-            elif choice == "q":
-                print("\n👋 Goodbye!")
-                # Cleanup temp file
-                if audio_path.exists():
-                    audio_path.unlink()
-                os.rmdir(temp_dir)
-                sys.exit(0)
+            # Ask user what to do next
+            print("\n" + "─" * 40)
+            print("Options:")
+            print("  [r] Regenerate with same phrase")
+            print("  [g] Generate several variants")
+            print("  [p] Play again")
+            print("  [s] Save to file")
+            print("  [n] New phrase")
+            print("  [v] Change voice")
+            print("  [e] Edit voice settings")
+            print("  [q] Quit")
             
-            else:
-                print("Invalid choice. Please enter r, p, s, n, v, e, or q.")
-    
-    # Cleanup
-    if audio_path.exists():
-        audio_path.unlink()
-    os.rmdir(temp_dir)
+            while True:
+                choice = input("\nYour choice: ").strip().lower()
+                if CHOICE_HANDLERS.get(choice, handle_invalid)(session):
+                    break
 
 
 if __name__ == "__main__":
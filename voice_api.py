@@ -0,0 +1,188 @@
+"""
+Voice Sampler - ElevenLabs API helpers
+Streaming synthesis, concurrent variants and the on-disk audio cache,
+shared by the command line tool (main.py) and the web UI (app.py).
+"""
+
+import asyncio
+import hashlib
+import json
+import random
+import struct
+import time
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+import aiofiles
+import httpx
+from elevenlabs import AsyncElevenLabs, VoiceSettings
+
+TTS_STREAM_URL = "https://api.elevenlabs.io/v1/text-to-speech/{voice_id}/stream"
+MODEL_ID = "eleven_multilingual_v2"
+
+# Bytes per read from the response: smaller chunks reach the player
+# sooner, larger ones cost fewer reads
+STREAM_CHUNK_SIZE = 16 * 1024
+
+# One pooled HTTP/2 client serves every call, so regenerations reuse the
+# open socket and concurrent variants multiplex over it
+HTTP_LIMITS = httpx.Limits(
+    max_keepalive_connections=8,
+    max_connections=16,
+    keepalive_expiry=300,
+)
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+
+# Upper bound on simultaneous API requests when generating variants
+MAX_CONCURRENT_REQUESTS = 4
+
+# Most variants generated per batch, in both the CLI and the web UI
+MAX_VARIANTS = 8
+
+# The API accepts seeds in the unsigned 32-bit range
+MAX_SEED = 2**32 - 1
+
+# Generated audio is cached here so identical requests skip the API
+CACHE_DIR = Path(__file__).resolve().parent / "recordings" / ".cache"
+CACHE_TTL = 3600  # seconds
+
+
+def create_http_client() -> httpx.Client:
+    """Create the HTTP/2 client shared by all API calls."""
+    return httpx.Client(http2=True, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+
+
+def stream_tts(
+    http_client: httpx.Client,
+    api_key: str,
+    text: str,
+    voice_id: str,
+    voice_settings: dict,
+    output_format: str = "mp3_44100_128",
+) -> Iterator[bytes]:
+    """Stream audio from the TTS streaming endpoint.
+    
+    Posts to the REST API directly instead of going through the SDK, so
+    chunks come straight from the response with no extra wrapping.
+    """
+    with http_client.stream(
+        "POST",
+        TTS_STREAM_URL.format(voice_id=voice_id),
+        params={"optimize_streaming_latency": 3, "output_format": output_format},
+        headers={"xi-api-key": api_key},
+        json={"text": text, "model_id": MODEL_ID, "voice_settings": voice_settings},
+    ) as response:
+        if response.is_error:
+            # The body is not read for streamed responses; pull it in so the
+            # API's error message isn't lost
+            response.read()
+            raise httpx.HTTPStatusError(
+                f"TTS request failed ({response.status_code}): {error_detail(response)}",
+                request=response.request,
+                response=response,
+            )
+        yield from response.iter_bytes(STREAM_CHUNK_SIZE)
+
+
+def error_detail(response: httpx.Response) -> str:
+    """Extract the error message from an API error response."""
+    try:
+        detail = response.json().get("detail", response.text)
+    except (ValueError, AttributeError):
+        return response.text
+    if isinstance(detail, dict):
+        return detail.get("message") or json.dumps(detail)
+    return str(detail)
+
+
+def wav_header(data_size: int, rate: int) -> bytes:
+    """Build a WAV header for mono 16-bit PCM."""
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + data_size, b"WAVE",
+        b"fmt ", 16, 1, 1, rate, rate * 2, 2, 16,
+        b"data", data_size,
+    )
+
+
+def new_seed_base(count: int) -> int:
+    """Pick a random first seed so each batch of count variants is new."""
+    return random.randint(0, MAX_SEED - count + 1)
+
+
+async def generate_variants(
+    api_key: str,
+    text: str,
+    voice_id: str,
+    voice_settings: dict,
+    seeded_paths: List[Tuple[int, Path]],
+    output_format: str = "mp3_44100_128",
+    pcm_rate: Optional[int] = None,
+) -> None:
+    """Generate several seeded variations of a phrase concurrently.
+    
+    Each (seed, path) pair is synthesized with that seed and streamed to
+    path through aiofiles, so disk writes don't stall the other
+    downloads. Files are written under a .part name and renamed once
+    complete. With `pcm_rate` set, raw PCM is wrapped in a WAV header.
+    At most MAX_CONCURRENT_REQUESTS requests are in flight at once.
+    """
+    http_client = httpx.AsyncClient(http2=True, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+    client = AsyncElevenLabs(api_key=api_key, httpx_client=http_client)
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    settings = VoiceSettings(**voice_settings)
+    
+    async def synthesize(seed: int, path: Path) -> None:
+        partial_path = path.with_suffix(".part")
+        async with semaphore:
+            try:
+                async with aiofiles.open(partial_path, "wb") as f:
+                    if pcm_rate:
+                        await f.write(wav_header(0, pcm_rate))
+                    data_size = 0
+                    async for chunk in client.text_to_speech.convert(
+                        voice_id=voice_id,
+                        text=text,
+                        model_id=MODEL_ID,
+                        voice_settings=settings,
+                        seed=seed,
+                        output_format=output_format,
+                    ):
+                        await f.write(chunk)
+                        data_size += len(chunk)
+                    if pcm_rate:
+                        # Sizes are only known now; rewrite the header in place
+                        await f.seek(0)
+                        await f.write(wav_header(data_size, pcm_rate))
+            except Exception:
+                partial_path.unlink(missing_ok=True)
+                raise
+        partial_path.replace(path)
+    
+    # The async client is tied to this event loop, so close it here
+    async with http_client:
+        await asyncio.gather(*(synthesize(seed, path) for seed, path in seeded_paths))
+
+
+def get_cache_path(ext: str = ".mp3", **key) -> Path:
+    """Get the on-disk cache file for a synthesis request described by key."""
+    digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+    return CACHE_DIR / f"{digest}{ext}"
+
+
+def is_cache_fresh(path: Path) -> bool:
+    """Check whether a cache file exists and is younger than CACHE_TTL."""
+    return path.exists() and time.time() - path.stat().st_mtime < CACHE_TTL
+
+
+def sweep_cache() -> None:
+    """Remove expired files from the audio cache.
+    
+    Covers every entry regardless of format, including .part files left
+    behind by interrupted downloads.
+    """
+    if not CACHE_DIR.exists():
+        return
+    for path in CACHE_DIR.iterdir():
+        if path.is_file() and not is_cache_fresh(path):
+            path.unlink(missing_ok=True)